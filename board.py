@@ -1,140 +1,150 @@
 import numpy as np
 from typing import Self
-from tabulate import tabulate
 
-import directions
+import fast
 
 
-N_CONNECT = 4
-
 STONE_NAMES = {
     0: "",
     1: "x",
     -1: "o"
 }
 
-STONE_MAP = np.vectorize(lambda stone: STONE_NAMES[stone])
+# stone names indexed by stone + 1
+STONE_LUT = np.array([STONE_NAMES[-1], STONE_NAMES[0], STONE_NAMES[1]])
+
+# which bitboard belongs to which player
+PLAYER_INDEX = {
+    1: 0,
+    -1: 1
+}
 
 
 class Board:
     def __init__(self, width=7, height=6):
         self.width = width
         self.height = height
-        # board itself
-        self.stones = np.zeros((self.height, self.width), dtype=np.int8)
-        # where the next stone can be put in each column
-        self.top = np.zeros(self.width, dtype=np.int8)
+        # every column gets an extra empty cell on top, so lines can't wrap around into the next column
+        self.column_height = height + 1
+        if width * self.column_height >= 64:
+            raise ValueError(f"A {width}x{height} board does not fit into a 64 bit integer.")
+        # board itself: one bitboard for each player, the cell (y, x) is bit x * column_height + y
+        self.bb = [0, 0]
+        # bit where the next stone can be put in each column
+        self.heights = [x * self.column_height for x in range(self.width)]
+        # bit of the (always empty) extra cell on top of each column
+        self.ceilings = [x * self.column_height + self.height for x in range(self.width)]
+        # number of stones on the board
+        self.stones_placed = 0
+        # bottom cell of every column, and all cells on the board
+        self.bottom_mask = sum(1 << (x * self.column_height) for x in range(self.width))
+        self.board_mask = self.bottom_mask * ((1 << self.height) - 1)
+        # unique key of the position: stones of player 1 + all stones, and the same for the position mirrored left to right.
+        # all stones fill each column from the bottom, adding the stones of player 1 to them can't carry into the next column.
+        self.key = 0
+        self.mirror_key = 0
+        # lines of `fast.N_CONNECT` cells through each bit
+        self.lines = fast.line_table(width, height)
+        # threat score of each player, see `fast.THREAT_WEIGHTS`
+        self.threats = [0, 0]
 
     def put(self, stone: int, column: int):
         if column < 0 or column >= self.width:
             raise IndexError(f"Column {column} does not exist.")
-        if self.full(column):
-            raise IndexError(f"Column {column} is already full.")
         # put it at the top of the column
-        x, y = column, self.top[column]
-        self.stones[y, x] = stone
+        bit = self.heights[column]
+        if bit >= self.ceilings[column]:
+            raise IndexError(f"Column {column} is already full.")
+        index = PLAYER_INDEX[stone]
+        # only the lines through the new stone change their threats
+        own_delta, enemy_delta = fast.threat_deltas(self.bb[index], self.bb[1 - index], self.lines, bit)
+        self.threats[index] += own_delta
+        self.threats[1 - index] += enemy_delta
+        self.bb[index] ^= 1 << bit
+        # a stone of player 1 counts twice (+1 for all stones, +1 for player 1)
+        self.key += (2 - index) << bit
+        self.mirror_key += (2 - index) << self.mirror_bit(bit, column)
         # update the top of the column
-        self.top[column] += 1
+        self.heights[column] = bit + 1
+        self.stones_placed += 1
+
+    def mirror_bit(self, bit: int, column: int) -> int:
+        """The bit at the same height as `bit` (which is in `column`), but in the mirrored column."""
+
+        return bit + (self.width - 1 - 2 * column) * self.column_height
 
     def full(self, column: int) -> bool:
-        return self.top[column] >= self.height
+        return self.heights[column] >= self.ceilings[column]
 
     def all_full(self) -> bool:
-        return np.all(self.top >= self.height)
+        return self.stones_placed >= self.width * self.height
+
+    def free_row(self, column: int) -> int:
+        """The row where the next stone in `column` would be put."""
+
+        return self.heights[column] - column * self.column_height
+
+    @property
+    def stones(self) -> np.ndarray:
+        """The board as a `height x width` array of stones. Only meant for displaying the board."""
 
-    def within_bounds(self, position: np.ndarray) -> bool:
-        y, x = position
-        return 0 <= x and x < self.width and 0 <= y and y < self.height
+        bits = np.arange(self.height)[:, np.newaxis] + np.arange(self.width) * self.column_height
+        stones = np.zeros((self.height, self.width), dtype=np.int8)
+        for stone, index in PLAYER_INDEX.items():
+            stones[(self.bb[index] >> bits) & 1 == 1] = stone
+        return stones
 
     def __getitem__(self, item) -> int:
-        return self.stones[item]
+        y, x = item
+        bit = 1 << (x * self.column_height + y)
+        if self.bb[0] & bit:
+            return 1
+        if self.bb[1] & bit:
+            return -1
+        return 0
+
+    def __hash__(self) -> int:
+        return self.key
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Board):
+            return NotImplemented
+        # the key is unique for boards of the same size
+        return self.key == other.key and self.width == other.width and self.height == other.height
 
     def __repr__(self) -> str:
-        return f"({','.join([''.join(column) for column in STONE_MAP(self.stones.T)])})"
+        columns = [''.join(STONE_NAMES[self[y, x]] for y in range(self.free_row(x))) for x in range(self.width)]
+        return f"({','.join(columns)})"
 
     def __str__(self) -> str:
+        # only needed for printing, so it's not imported with the board
+        from tabulate import tabulate
+
         horizontal_line = np.array(["="] * self.width)
         indices = range(self.width)
-        contents = STONE_MAP(np.flip(self.stones, axis=0))
+        contents = STONE_LUT[np.flip(self.stones, axis=0) + 1]
         return tabulate(np.vstack([horizontal_line, contents, horizontal_line, indices]), tablefmt='plain')
 
     def copy(self) -> Self:
         copied = Board(self.width, self.height)
-        copied.stones = self.stones.copy()
-        copied.top = self.top.copy()
+        copied.bb = self.bb.copy()
+        copied.heights = self.heights.copy()
+        copied.stones_placed = self.stones_placed
+        copied.key = self.key
+        copied.mirror_key = self.mirror_key
+        copied.threats = self.threats.copy()
         return copied
 
 
-def winning_on(board: Board, player: int, position: np.ndarray) -> bool:
+def winning_on(board: Board, player: int, y: int, x: int) -> bool:
+    """Checks if `player` won with the stone on (`y`, `x`), which has to be the last stone that was put on the board."""
+
+    stones = board.bb[PLAYER_INDEX[player]]
     # if there's no stone from player on the position, that player is not winning there
-    if board[*position] != player:
+    if not (stones >> (x * board.column_height + y)) & 1:
         return False
-    # if there are 3 stones pointing into this position and there's a stone on the position, it's winning
-    return max_stones_into(board, player, position) == N_CONNECT - 1
-
-
-def max_stones_into(board: Board, player: int, position: np.ndarray) -> int:
-    """The max amount of stones by `player` pointing into `position` in any direction. Capped by `N_CONNECT - 1` (default: `4 - 1 = 3`)"""
-
-    # directions with a horizontal part have to be checked in both ways
-    dangers = [stones_in_direction(board, player, position, d) + stones_in_direction(board, player, position, -d) for d in [directions.NE, directions.E, directions.SE]]
-    # north does not need to be checked
-    dangers.append(stones_in_direction(board, player, position, directions.S))
-    return min(max(dangers), N_CONNECT - 1)
-
-
-def stones_in_direction(board: Board, player: int, position: np.ndarray, direction: np.ndarray) -> int:
-    """The amount of stones by `player` pointing into `position` in `direction`. Capped by `N_CONNECT - 1` (default: `4 - 1 = 3`)"""
-
-    # copy needed or else the position array is changed in place
-    current_pos = position.copy()
-    for steps in range(1, N_CONNECT):
-        # go 1 step in the direction
-        current_pos += direction
-        # if the board ends here, the line ended at the last step
-        if not board.within_bounds(current_pos):
-            return steps - 1
-        # if there's no stone from the player on that position, the line ended at the last step
-        if board[*current_pos] != player:
-            return steps - 1
-    # if we only found stones from the player, then the number of stones was the number of iterations (N_CONNECT - 1)
-    return N_CONNECT - 1
-
-
-def evaluate(board: Board, player: int, on_turn: int) -> float:
-    """Evaluates the `board` for `player`. `on_turn` is the player that's turn it is currently.
-
-    Returns
-    -------
-    float
-        Number in between -1 and 1: 1 indicates `player` winning, -1 indicates `player` losing, 0 indicates draw.
-    """
-
-    enemy = -player
-    player_score = 0
-    enemy_score = 0
-    for column in range(board.width):
-        # ignore full columns
-        if board.full(column):
-            continue
-        # get top cell and look how many stones are pointing into it
-        x, y = column, board.top[column]
-        position = np.array([y, x])
-        player_stones = max_stones_into(board, player, position)
-        enemy_stones = max_stones_into(board, enemy, position)
-        # if we got 3 stones in a row and it's our turn, we're winning
-        if player_stones == N_CONNECT - 1 and player == on_turn:
-            return 1
-        # opposite holds for the enemy
-        if enemy_stones == N_CONNECT - 1 and enemy == on_turn:
-            return -1
-        # add score to the total score
-        player_score += player_stones
-        enemy_score += enemy_stones
-    # 1 if player got all the scores, -1 if enemy got all the scores
-    if player_score + enemy_score == 0:
-        return 0
-    return (player_score - enemy_score) / (player_score + enemy_score)
+    # nobody won before the last stone, so if there's a line now, it goes through the position
+    return fast.has_won(stones, board.column_height)
 
 
 def main():
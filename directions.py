@@ -1,11 +1,9 @@
-import numpy as np
-
-# NORTH, EAST, SOUTH, WEST
-E = np.array([0, 1])
-N = np.array([1, 0])
-W = -E
-S = -N
-NE = N + E
-NW = N + W
-SE = S + E
-SW = S + W
+# NORTH, EAST, SOUTH, WEST as (dy, dx)
+E = (0, 1)
+N = (1, 0)
+W = (0, -1)
+S = (-1, 0)
+NE = (1, 1)
+NW = (1, -1)
+SE = (-1, 1)
+SW = (-1, -1)
@@ -0,0 +1,291 @@
+import functools
+import numpy as np
+from numba import njit
+
+import directions
+
+N_CONNECT = 4
+
+# threat score of a line of `N_CONNECT` cells, by the number of stones in it. only lines without enemy stones count.
+# open lines with 2 or 3 stones are threats, full lines end the game anyway.
+THREAT_WEIGHTS = (0, 0, 1, 3, 0)
+
+# evaluation of a position that the player on turn wins. the search only uses integer scores.
+WIN = 10000
+# heuristic evaluations are between -EVALUATION_SCALE and EVALUATION_SCALE, so they never tie with a win
+EVALUATION_SCALE = 1000
+# bigger than every evaluation, bounds of the full alpha-beta window
+INFINITY = 2**31 - 1
+
+# bounds of the values in the transposition table
+EXACT = 0
+# the real evaluation is at least the stored value
+LOWER = 1
+# the real evaluation is at most the stored value
+UPPER = 2
+
+
+@functools.cache
+def line_table(width: int, height: int) -> np.ndarray:
+    """For every bit of the bitboard, the bitmasks of all lines of `N_CONNECT` cells through it. Rows are padded with 0."""
+
+    column_height = height + 1
+    # every line on the board, by its first cell and direction
+    lines = []
+    for x in range(width):
+        for y in range(height):
+            for dy, dx in [directions.N, directions.E, directions.NE, directions.SE]:
+                last_y, last_x = y + (N_CONNECT - 1) * dy, x + (N_CONNECT - 1) * dx
+                if 0 <= last_y < height and last_x < width:
+                    lines.append(sum(1 << ((x + i * dx) * column_height + y + i * dy) for i in range(N_CONNECT)))
+    # a cell is part of at most N_CONNECT lines in each of the 4 directions
+    table = np.zeros((width * column_height, 4 * N_CONNECT), dtype=np.int64)
+    n_lines = [0] * (width * column_height)
+    for line in lines:
+        for bit in range(width * column_height):
+            if (line >> bit) & 1:
+                table[bit, n_lines[bit]] = line
+                n_lines[bit] += 1
+    return table
+
+
+@njit(cache=True, inline='always')
+def popcount(bits: int) -> int:
+    """Number of set bits."""
+
+    count = 0
+    while bits:
+        # remove the lowest set bit
+        bits &= bits - 1
+        count += 1
+    return count
+
+
+@njit(cache=True)
+def has_won(bitboard: int, column_height: int) -> bool:
+    """Checks if there are `N_CONNECT` (= 4) stones in a line anywhere on the `bitboard`."""
+
+    # vertical, horizontal and both diagonals
+    for shift in (1, column_height, column_height - 1, column_height + 1):
+        # bits where the next stone in the direction is also set
+        pairs = bitboard & (bitboard >> shift)
+        # two pairs after each other are 4 in a row
+        if pairs & (pairs >> 2 * shift):
+            return True
+    return False
+
+
+@njit(cache=True)
+def threat_deltas(player_stones: int, enemy_stones: int, lines: np.ndarray, bit: int) -> tuple[int, int]:
+    """How the threat scores of both players change when the player puts a stone on `bit`. Only the `lines` through `bit` (see `line_table`) change."""
+
+    player_delta = 0
+    enemy_delta = 0
+    for line in lines[bit]:
+        # no more lines through the bit
+        if line == 0:
+            break
+        player_count = popcount(player_stones & line)
+        enemy_count = popcount(enemy_stones & line)
+        # the line gets another stone from the player
+        if enemy_count == 0:
+            player_delta += THREAT_WEIGHTS[player_count + 1] - THREAT_WEIGHTS[player_count]
+        # the line is no longer open for the enemy
+        if player_count == 0:
+            enemy_delta -= THREAT_WEIGHTS[enemy_count]
+    return player_delta, enemy_delta
+
+
+@njit(cache=True)
+def winning_cells(stones: int, column_height: int) -> int:
+    """Bitboard of all cells that would complete a line of `N_CONNECT` (= 4) `stones`. Includes cells that are already taken or not on the board."""
+
+    # vertical: 3 stones below
+    cells = (stones << 1) & (stones << 2) & (stones << 3)
+    # horizontal and both diagonals: 3 stones on one side, or 2 on one side and 1 on the other
+    for shift in (column_height, column_height - 1, column_height + 1):
+        pairs = (stones << shift) & (stones << 2 * shift)
+        cells |= pairs & (stones << 3 * shift)
+        cells |= pairs & (stones >> shift)
+        pairs = (stones >> shift) & (stones >> 2 * shift)
+        cells |= pairs & (stones << shift)
+        cells |= pairs & (stones >> 3 * shift)
+    return cells
+
+
+@njit(cache=True)
+def evaluate(player_stones: int, enemy_stones: int, bottom_mask: int, board_mask: int, column_height: int, player_threats: int, enemy_threats: int) -> int:
+    """Evaluates the bitboards for the player with `player_stones`, whose turn it is. The threat scores are the ones kept on the board."""
+
+    # the top cell of every column that is not full
+    playable = ((player_stones | enemy_stones) + bottom_mask) & board_mask
+    # if we can complete a line in a top cell, we're winning
+    if winning_cells(player_stones, column_height) & playable:
+        return WIN
+    # EVALUATION_SCALE if player got all the threats, -EVALUATION_SCALE if enemy got all the threats, 0 if there are none
+    total = player_threats + enemy_threats
+    if total == 0:
+        return 0
+    # rounded towards 0, so the evaluation for the enemy is exactly the negative
+    score = EVALUATION_SCALE * abs(player_threats - enemy_threats) // total
+    return score if player_threats >= enemy_threats else -score
+
+
+@njit(cache=True, inline='always')
+def ordered_before(column: int, other: int, known_move: int, center_scores: np.ndarray, history: np.ndarray) -> bool:
+    """Checks if `column` should be searched before `other`: known best move first, then central columns, then columns with a better history."""
+
+    if (column == known_move) != (other == known_move):
+        return column == known_move
+    if center_scores[column] != center_scores[other]:
+        return center_scores[column] > center_scores[other]
+    return history[column] > history[other]
+
+
+@njit(cache=True)
+def negamax(player_stones: int, enemy_stones: int, player_threats: int, enemy_threats: int, key: int, mirror_key: int, first_player: bool, depth: int, alpha: int, beta: int, geometry: tuple, table: tuple, history: np.ndarray, center_scores: np.ndarray, symmetry: bool) -> tuple[int, int]:
+    """Evaluates the position for the player with `player_stones`, whose turn it is, with alpha-beta pruning `depth` moves deep. Returns evaluation and best move.
+
+    Parameters
+    ----------
+    player_threats, enemy_threats: int
+        Threat scores as kept on the board.
+    key, mirror_key: int
+        Key of the position and its mirror image, as kept on the board.
+    first_player: bool
+        If the player on turn is player 1 (needed to update the keys).
+    geometry: tuple
+        Width, height, bottom mask, board mask and `line_table` of the board.
+    table: tuple
+        Transposition table as arrays of keys (-1 for empty slots), depths, values, bounds and best moves.
+    history: np.ndarray
+        How many (and how deep) cutoffs each column caused, for player 1 and player 2.
+    center_scores: np.ndarray
+        How many lines go through the bottom cell of each column.
+    symmetry: bool
+        If a position and its mirror image share their entry in the transposition table, and mirrored moves in symmetric positions are only searched once.
+    """
+
+    width, height, bottom_mask, board_mask, lines = geometry
+    keys, depths, values, bounds, moves = table
+    column_height = height + 1
+    # don't expand any further, use the evaluation function instead
+    if depth <= 0:
+        return evaluate(player_stones, enemy_stones, bottom_mask, board_mask, column_height, player_threats, enemy_threats), -1
+    occupied = player_stones | enemy_stones
+    # the top cell of every column that is not full
+    playable = (occupied + bottom_mask) & board_mask
+    column_cells = (1 << height) - 1
+    # if we can win right away, nothing else matters
+    wins = winning_cells(player_stones, column_height) & playable
+    if wins:
+        for column in range(width):
+            if (wins >> (column * column_height)) & column_cells:
+                return WIN, column
+    # if the enemy could win on a top cell, we have to block it. every other move loses right away.
+    enemy_wins = winning_cells(enemy_stones, column_height) & playable
+    forced_move = -1
+    if enemy_wins:
+        for column in range(width):
+            if (enemy_wins >> (column * column_height)) & column_cells:
+                # we can only block one of them
+                if forced_move != -1:
+                    return -WIN, forced_move
+                forced_move = column
+    # maybe we already searched the position (or its mirror image) via another order of moves
+    mirrored = symmetry and mirror_key < key
+    table_key = mirror_key if mirrored else key
+    slot = table_key % len(keys)
+    known_move = -1
+    if keys[slot] == table_key:
+        # the stored best move is for the stored position, it has to be mirrored back
+        known_move = int(moves[slot])
+        if mirrored and known_move != -1:
+            known_move = width - 1 - known_move
+        if depths[slot] >= depth:
+            if bounds[slot] == EXACT:
+                return values[slot], known_move
+            if bounds[slot] == LOWER:
+                alpha = max(alpha, values[slot])
+            else:
+                beta = min(beta, values[slot])
+            if alpha >= beta:
+                return values[slot], known_move
+    # window the position is actually searched with
+    window_alpha, window_beta = alpha, beta
+    # in a position that is its own mirror image, a move and its mirrored move are equally good
+    symmetric = symmetry and key == mirror_key
+    # playable columns in the order they are searched (insertion sort, equal columns stay left to right)
+    player_history = history[0 if first_player else 1]
+    columns = np.empty(width, dtype=np.int64)
+    n_columns = 0
+    for column in range(width):
+        if not (playable >> (column * column_height)) & column_cells:
+            continue
+        if forced_move != -1 and column != forced_move:
+            continue
+        if symmetric and column > width - 1 - column:
+            continue
+        i = n_columns
+        while i > 0 and ordered_before(column, columns[i - 1], known_move, center_scores, player_history):
+            columns[i] = columns[i - 1]
+            i -= 1
+        columns[i] = column
+        n_columns += 1
+    # player 1 stones count twice in the key
+    key_weight = 2 if first_player else 1
+    best_value = -INFINITY
+    best_move = -1
+    for i in range(n_columns):
+        column = columns[i]
+        # add a stone in the column
+        bit = column * column_height + popcount(occupied & (column_cells << (column * column_height)))
+        move = 1 << bit
+        # none of the moves wins (we checked that already), if the board is full that's a draw
+        if occupied | move == board_mask:
+            value = 0
+        else:
+            # only the lines through the new stone change their threats
+            own_delta, enemy_delta = threat_deltas(player_stones, enemy_stones, lines, bit)
+            child_key = key + (key_weight << bit)
+            child_mirror_key = mirror_key + (key_weight << (bit + (width - 1 - 2 * column) * column_height))
+            child_threats = enemy_threats + enemy_delta, player_threats + own_delta
+            # the first child is probably the best one. the others only have to be proven worse, a null window does that fastest.
+            child_beta = beta if i == 0 else alpha + 1
+            # the child is evaluated for the enemy, what's good for them is bad for us
+            value, _ = negamax(enemy_stones, player_stones | move, child_threats[0], child_threats[1], child_key, child_mirror_key, not first_player, depth - 1, -child_beta, -alpha, geometry, table, history, center_scores, symmetry)
+            value = -value
+            # it's better than the first child after all, search it again for its real value
+            if alpha < value < beta and child_beta != beta:
+                value, _ = negamax(enemy_stones, player_stones | move, child_threats[0], child_threats[1], child_key, child_mirror_key, not first_player, depth - 1, -beta, -alpha, geometry, table, history, center_scores, symmetry)
+                value = -value
+        # remember the best child and narrow the window
+        if value > best_value:
+            best_value, best_move = value, column
+        alpha = max(alpha, value)
+        # the other player would never let it come this far, the other children don't matter
+        if alpha >= beta:
+            # the column is probably good in other positions as well
+            player_history[column] += depth * depth
+            break
+    # outside of the window we only know a bound
+    if best_value <= window_alpha:
+        bound = UPPER
+    elif best_value >= window_beta:
+        bound = LOWER
+    else:
+        bound = EXACT
+    # always replace, the newest search is usually the most relevant one
+    keys[slot] = table_key
+    depths[slot] = depth
+    values[slot] = best_value
+    bounds[slot] = bound
+    moves[slot] = width - 1 - best_move if mirrored and best_move != -1 else best_move
+    return best_value, best_move
+
+
+# compile (or load from cache) now instead of in the middle of the first search
+has_won(0, 7)
+threat_deltas(0, 0, line_table(7, 6), 0)
+evaluate(0, 0, 1, 1, 7, 0, 0)
+negamax(0, 0, 0, 0, 0, 0, True, 1, -INFINITY, INFINITY, (1, 1, 1, 1, line_table(1, 1)), (np.full(1, -1, dtype=np.int64), np.zeros(1, dtype=np.int8), np.zeros(1, dtype=np.int32), np.zeros(1, dtype=np.int8), np.zeros(1, dtype=np.int8)), np.zeros((2, 1), dtype=np.int64), np.zeros(1, dtype=np.int64), True)
@@ -1,10 +1,11 @@
 import time
-import numpy as np
 from enum import Enum
 from board import Board, STONE_NAMES, winning_on
 from search import SearchTree
 
 LOG = False
+# seconds the npc may think before it stops searching deeper (None: always search until search.MAX_DEPTH)
+TIME_BUDGET = None
 
 
 class PlayerTypes(Enum):
@@ -37,15 +38,14 @@ class Game:
             player_type = self.player1_type if player == 1 else self.player2_type
             column = self.get_pc_move(player) if player_type == PlayerTypes.PC else self.get_npc_move(player)
             # get position where the stone should be put
-            x, y = column, self.board.top[column]
-            position = np.array([y, x])
+            x, y = column, self.board.free_row(column)
             # put it there
             self.board.put(player, column)
             # maybe print the new board
             if print_board:
                 print(self.board)
             # check if the player won with that move
-            if winning_on(self.board, player, position):
+            if winning_on(self.board, player, y, x):
                 return Results.PLAYER1_WIN if player == 1 else Results.PLAYER2_WIN
             # if the board is full and no one won, that's a draw
             if self.board.all_full():
@@ -73,7 +73,7 @@ class Game:
 
         # search game tree for options and maximize evaluation
         start = time.time()
-        tree = SearchTree(self.board, player, log=LOG)
+        tree = SearchTree(self.board, player, log=LOG, time_budget=TIME_BUDGET)
         evaluation, best_move = tree.search()
         end = time.time()
         print(f"Best move evaluation: {evaluation}")
@@ -1,280 +1,86 @@
-import math
+import time
 import numpy as np
 
-from board import Board, evaluate, winning_on
+import fast
+from board import Board, PLAYER_INDEX
 
 MAX_DEPTH = 4
+# number of slots in the transposition table, a position goes into slot key % TABLE_SIZE.
+# prime, so positions that only differ in the right columns (high bits of the key) are spread out as well.
+TABLE_SIZE = 1048583
+# half width of the window around the last evaluation that the next deeper search starts with
+ASPIRATION_WINDOW = fast.EVALUATION_SCALE // 4
+# store a position and its mirror image as the same entry in the transposition table
+SYMMETRY = True
 
-IS_MAX_NODE = lambda d: d % 2 == 0
-IS_MIN_NODE = lambda d: d % 2 == 1
-# maximizer: init with -infty
-# minimizer: init with infty
-INIT_NODE = lambda d: -math.inf if IS_MAX_NODE(d) else math.inf
+
+def center_scores(board: Board) -> list[int]:
+    """How many lines go through the bottom cell of each column (3, 4, 5, 7, 5, 4, 3 on a 7x6 board). Central columns are part of more lines, so they are usually the better moves."""
+
+    return [int(np.count_nonzero(board.lines[column * board.column_height])) for column in range(board.width)]
 
 
 class SearchTree:
-    def __init__(self, root_board: Board, player: int, log=False):
+    def __init__(self, root_board: Board, player: int, log=False, time_budget: float | None = None):
         self.log = log
+        # seconds after which no deeper search is started (None: always search until MAX_DEPTH)
+        self.time_budget = time_budget
         self.root_board = root_board
         self.player = player
-        # we start at the root with depth = 0
-        self.depth = 0
-        # max over min nodes
-        self.alpha = -math.inf
-        # min over max nodes
-        self.beta = math.inf
-        # stores node ids and their depth in the search tree, and the column that was changed
-        # root did not change any position
-        self.worklist_nodes: list[Board] = [root_board]
-        self.worklist_depths: list[int] = [0]
-        self.worklist_changed: list[int] = [-1]
-        self.expanded_nodes: set[Board] = set()
-        self.evaluated: set[Board] = set()
-        self.evaluation: dict[Board, float] = {}
-        self.parent: dict[Board, Board] = {}
-        # depth -> current siblings on that depth
-        self.siblings: list[list[Board]] = [[root_board]]
-        # flag to save if something was pruned
-        self.just_pruned = False
-
-    def search(self) -> tuple[float, int]:
-        """Evaluates the position. Returns evaluation and best move."""
-
-        # get the next board as long as the root board isn't evaluated
-        while (board := self.get_next()) and self.root_board not in self.evaluated:
-            # if the node was not evaluated yet:
-            # - but it's a leaf or we don't want to expand it, evaluate it now
-            # - else add children and start over
-            if board not in self.evaluated:
-                # if x is a leaf, evaluate it and go on
-                if self.is_leaf(board):
-                    continue
-                # if we don't want to expand the node, evaluate it using the evaluation function
-                if self.depth >= MAX_DEPTH:
-                    self.evaluation[board] = evaluate(board, self.player, self.on_turn)
-                    self.evaluated.add(board)
-                    continue
-                # we want to expand
-                self.evaluation[board] = INIT_NODE(self.depth)
-                self.expand(board)
-                continue
-
-            # node has an evaluation
-            self.propagate(board)
-            # maybe prune
-            self.just_pruned = False
-            if self.prunable(board):
-                self.prune(self.parent[board])
-                self.just_pruned = True
-                continue
-            # remove node from list and get a new one
-            self.prune_last()
-
-        return self.evaluation[self.root_board], self.best_move
-
-    def get_next(self) -> Board:
-        """Gets next node in list and prepares the loop."""
-
-        # save previous depth so we know when we go back up
-        self.previous_depth = self.depth
-        # pop top node, depth, changed position
-        board = self.worklist_nodes[-1]
-        self.depth = self.worklist_depths[-1]
-        self.changed_column = self.worklist_changed[-1]
-        # maximizer (even depth): it's my players turn
-        # minimizer (odd depth): it's the enemy players turn
-        self.on_turn = self.player if self.depth % 2 == 0 else -self.player
-        # if we change the depth in any way, the alphas/betas may have to be updated
-        if self.depth != self.previous_depth:
-            self.collect_alpha_beta(board)
-        # if all the children were pruned, also prune this node and get a new one
-        if self.all_children_pruned(board):
-            self.propagate(board)
-            self.prune_last()
-            return self.get_next()
-        # if we're done with all the children, then the node has been fully evaluated
-        if self.all_children_done(board):
-            self.evaluated.add(board)
-        # if we go back up, we can remove some alphas/betas
-        if self.depth < self.previous_depth:
-            self.clean_siblings()
-        # update if we just pruned
-        return board
-
-    def all_children_pruned(self, board: Board) -> bool:
-        """Checks if all children of the current board were pruned."""
-
-        # if all the children are done but the parent node wasn't overwritten, then all children were pruned
-        return self.all_children_done(board) and self.evaluation[board] == INIT_NODE(self.depth)
-
-    def all_children_done(self, board: Board) -> bool:
-        """Checks if we just completed visiting all the children."""
-
-        # if we already expanded the node but we find it again, all children are done
-        return board in self.expanded_nodes
-
-    def is_leaf(self, board: Board) -> bool:
-        """Checks if a board is a leaf. If it is, it is immediately evaluated."""
-
-        # root didn't change any column, it can't be a leaf.
-        if board == self.root_board:
-            return False
-        # see if board is a leaf. If yes, evaluate it.
-        x, y = self.changed_column, board.top[self.changed_column] - 1
-        stone_position = np.array([y, x])
-        if winning_on(board, self.player, stone_position):
-            self.evaluation[board] = 1
-            self.evaluated.add(board)
-            return True
-        elif winning_on(board, -self.player, stone_position):
-            self.evaluation[board] = -1
-            self.evaluated.add(board)
-            return True
-        return False
-
-    def expand(self, board: Board):
-        """Adds all possible children to node list."""
-
-        # generate children and add them to the lists]
-        self.siblings.append([])
-        for column in range(self.root_board.width):
-            # skip full columns
-            if board.full(column):
-                continue
-            child_board = board.copy()
-            # add a stone by on_turn in the column
-            child_board.put(self.on_turn, column)
-            # assign an id to the child board
-            self.parent[child_board] = board
-            # add child to node list
-            self.siblings[self.depth + 1].append(child_board)
-            self.worklist_nodes.append(child_board)
-            self.worklist_depths.append(self.depth + 1)
-            self.worklist_changed.append(column)
-        self.expanded_nodes.add(board)
-
-    def prunable(self, board: Board) -> bool:
-        """Checks if board (and therefore its parent as well) is alpha/beta prunable."""
-
-        if IS_MAX_NODE(self.depth):
-            return self.evaluation[board] <= self.alpha
-        else:
-            return self.evaluation[board] >= self.beta
-
-    def prune_last(self):
-        """Remove the last node from the node list, so we can visit a new one."""
-
-        del self.worklist_nodes[-1]
-        del self.worklist_depths[-1]
-        del self.worklist_changed[-1]
-
-    def prune(self, board: Board):
-        """Prunes a board and all its chilren from the node list."""
-
-        index = self.worklist_nodes.index(board)
-        if self.log:
-            print(f"Pruned: {self.worklist_nodes[index:]}")
-        del self.worklist_nodes[index:]
-        del self.worklist_depths[index:]
-        del self.worklist_changed[index:]
-
-    def propagate(self, board: Board):
-        """Propagates the evaluation of the board up by 1 (remembers best move if parent is root)."""
-
-        parent = self.parent[board]
-        overwritten = self.update_parent(board, parent)
-        # if parent was overwritten, updte alpha/beta
-        if overwritten:
-            # if root was overwritten, consider it as the best move
-            if parent == self.root_board:
-                self.best_move = self.changed_column
-
-    def update_parent(self, board: Board, parent: Board) -> bool:
-        """Updates parent of any node. Returns `True` if it was overwritten."""
-
-        if IS_MAX_NODE(self.depth):
-            return self.update_max(board, parent)
-        else:
-            return self.update_min(board, parent)
-
-    def update_max(self, board: Board, parent: Board) -> bool:
-        """Updates the parent of a max node. Returns `True` if it was overwritten."""
-
-        # board in max node -> parent in min node
-        if self.evaluation[board] < self.evaluation[parent]:
-            # eval[p] = min(eval[p], eval[board])
-            self.evaluation[parent] = self.evaluation[board]
-            return True
-        return False
-
-    def update_min(self, board: Board, parent: Board) -> bool:
-        """Updates the parent of a min node. Returns `True` if it was overwritten."""
-
-        # board in min node -> parent in max node
-        if self.evaluation[board] > self.evaluation[parent]:
-            # eval[p] = max(eval[p], eval[board])
-            self.evaluation[parent] = self.evaluation[board]
-            return True
-        return False
-
-    def ancestors(self, board: Board) -> list[Board]:
-        """Calculates the ancestors of a board (this is also the root path)."""
-
-        ancestors: list[Board] = []
-        node = board
-        # while the node has a parent
-        while node in self.parent:
-            ancestors.append(node)
-            node = self.parent[node]
-        # all ancestors but root appended. root is ancestor to all.
-        ancestors.append(self.root_board)
-        return ancestors
-
-    def clean_siblings(self):
-        """Cleans up siblings that are no longer needed."""
-
-        del self.siblings[self.depth + 1:]
-
-    def collect_alpha_beta(self, board: Board):
-        """Combines alpha/beta of the layers above into 1 value."""
-
-        if IS_MAX_NODE(self.depth):
-            self.alpha = self.collect_alpha(board)
-        else:
-            self.beta = self.collect_beta(board)
-
-    def collect_alpha(self, board: Board) -> float:
-        ancestors = self.ancestors(board)
-        # only odd depths
-        alpha = -math.inf
-        for depth in range(1, self.depth, 2):
-            for sibling in self.siblings[depth]:
-                # not a sibling, but an ancestor
-                if sibling in ancestors:
-                    continue
-                # not a useful evaluation yet
-                if sibling not in self.evaluation:
-                    continue
-                if self.evaluation[sibling] == INIT_NODE(depth):
-                    continue
-                # actual evaluation and actual sibling
-                alpha = max(alpha, self.evaluation[sibling])
-        return alpha
-
-    def collect_beta(self, board: Board) -> float:
-        ancestors = self.ancestors(board)
-        # only even depths
-        beta = math.inf
-        for depth in range(0, self.depth, 2):
-            for sibling in self.siblings[depth]:
-                # not a sibling, but an ancestor
-                if sibling in ancestors:
-                    continue
-                # not a useful evaluation yet
-                if sibling not in self.evaluation:
-                    continue
-                if self.evaluation[sibling] == INIT_NODE(depth):
-                    continue
-                # actual evaluation and actual sibling
-                beta = min(beta, self.evaluation[sibling])
-        return beta
+        # what the compiled search needs to know about the board
+        self.geometry = (root_board.width, root_board.height, root_board.bottom_mask, root_board.board_mask, root_board.lines)
+        # children of a node are visited by the best move we know, how central they are, and their history
+        self.center_scores = np.array(center_scores(root_board), dtype=np.int64)
+        # how many (and how deep) cutoffs each column caused, for player 1 and player 2
+        self.history = np.zeros((2, root_board.width), dtype=np.int64)
+        # what we already know about positions: keys (-1: empty slot), depths, values, bounds (see fast.EXACT) and best moves
+        self.table = (
+            np.full(TABLE_SIZE, -1, dtype=np.int64),
+            np.zeros(TABLE_SIZE, dtype=np.int8),
+            np.zeros(TABLE_SIZE, dtype=np.int32),
+            np.zeros(TABLE_SIZE, dtype=np.int8),
+            np.zeros(TABLE_SIZE, dtype=np.int8)
+        )
+
+    def search(self) -> tuple[int, int]:
+        """Evaluates the position, searching 1 move deeper each time until MAX_DEPTH. Returns evaluation and best move."""
+
+        start = time.time()
+        evaluation = None
+        for depth in range(1, MAX_DEPTH + 1):
+            # the deeper search probably ends up close to the last one, a narrow window prunes more
+            if evaluation is None:
+                alpha, beta = -fast.INFINITY, fast.INFINITY
+            else:
+                alpha, beta = evaluation - ASPIRATION_WINDOW, evaluation + ASPIRATION_WINDOW
+            while True:
+                # the table keeps the best moves of the shallower searches, they are tried first in the deeper ones
+                value, move = self.negamax(depth, alpha, beta)
+                # outside of the window the value is only a bound, open the window on that side and search again
+                if value <= alpha:
+                    alpha = -fast.INFINITY
+                elif value >= beta:
+                    beta = fast.INFINITY
+                else:
+                    break
+            evaluation, best_move = value, move
+            if self.log:
+                print(f"Depth {depth}: evaluation {evaluation}, best move {best_move}")
+            # out of time: go with the deepest finished search
+            if self.time_budget is not None and time.time() - start > self.time_budget:
+                break
+        return evaluation, best_move
+
+    def negamax(self, depth: int, alpha: int, beta: int) -> tuple[int, int]:
+        """Evaluates the root board for `self.player` (who is on turn) with alpha-beta pruning `depth` moves deep. Returns evaluation and best move."""
+
+        board = self.root_board
+        # the player that searches is the first one on turn
+        index = PLAYER_INDEX[self.player]
+        return fast.negamax(
+            board.bb[index], board.bb[1 - index],
+            board.threats[index], board.threats[1 - index],
+            board.key, board.mirror_key, self.player == 1,
+            depth, alpha, beta,
+            self.geometry, self.table, self.history, self.center_scores, SYMMETRY
+        )